@@ -1,80 +1,212 @@
 #!/usr/bin/env python3
+import json
 import os
+import random
 import requests
-import sys
+import shutil
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-import certifi
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
+from urllib3.util.retry import Retry
 
-# Create the destination directory if it doesn't exist
-os.makedirs('docs/research', exist_ok=True)
+# Downloads are independent and network-bound, so fetch several at once
+MAX_WORKERS = 8
+
+COPY_BUFFER_SIZE = 1 << 20
+
+# (connect, read) seconds; the read timeout applies per socket read, so a
+# large file can take longer overall but a stalled transfer can't hang a worker
+TIMEOUT = (5, 60)
+
+# One session for every download: keep-alive connections to static.nhtsa.gov
+# and crashstats.nhtsa.dot.gov are reused instead of a new TCP+TLS handshake
+# per file. verify=False skips SSL verification, as before.
+SESSION = requests.Session()
+SESSION.verify = False
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=2,
+    pool_maxsize=MAX_WORKERS,
+    # Jittered exponential backoff that honours Retry-After, so parallel workers
+    # hitting a 429/503 don't all come back at the same instant. Only failed
+    # connections and throttling/server errors are retried: other 4xx
+    # responses and SSL errors won't change on a second try (other=0).
+    max_retries=Retry(
+        total=5,
+        other=0,
+        backoff_factor=0.5,
+        backoff_jitter=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        respect_retry_after_header=True,
+    ),
+))
+
+# Attempts per file when the connection drops or stalls mid-body. urllib3's
+# retries stop once the response headers arrive, so this covers only what
+# they can't, and each new attempt resumes from the .part file.
+MAX_ATTEMPTS = 3
+
+# ETag / Last-Modified of every downloaded file, so re-runs can send a
+# conditional GET and skip files NHTSA hasn't changed
+VALIDATORS_PATH = 'docs/research/.etag.json'
+
+# Serialises console output and the error log across worker threads
+_output_lock = threading.Lock()
+
+def report(message):
+    """Print a message without interleaving it with other threads' output"""
+    with _output_lock:
+        print(message)
 
 def log_error(url, output_path, error):
     """Log download errors to a file"""
     error_log_path = os.path.join('docs/research', 'download_errors.txt')
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     
-    with open(error_log_path, 'a', encoding='utf-8') as f:
+    with _output_lock, open(error_log_path, 'a', encoding='utf-8') as f:
         f.write(f"[{timestamp}]\n")
         f.write(f"URL: {url}\n")
         f.write(f"Target Path: {output_path}\n")
         f.write(f"Error: {str(error)}\n")
         f.write("-" * 80 + "\n\n")
 
-def download_file(url, output_path):
+def load_validators():
+    """Return the saved {output_path: {'etag': ..., 'last_modified': ...}} map"""
+    try:
+        with open(VALIDATORS_PATH, encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def save_validators(validators):
+    """Write the validator map atomically so an interrupted run can't corrupt it"""
+    tmp_path = VALIDATORS_PATH + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(validators, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, VALIDATORS_PATH)
+
+def read_etag(path):
+    """Return the ETag saved next to a file, or None"""
+    try:
+        with open(path + '.etag', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def write_etag(path, etag):
+    """Save a file's ETag in a sidecar, or remove a stale one if there is none"""
+    if etag:
+        with open(path + '.etag', 'w', encoding='utf-8') as f:
+            f.write(etag)
+    elif os.path.exists(path + '.etag'):
+        os.remove(path + '.etag')
+
+def fetch(url, output_path, validators):
     """
-    Download a file and save it to the specified path with a simple progress indicator
+    Download a file and save it to the specified path.
+    If a previous copy exists, ask the server to send it only if it changed.
+    The body is written to <output_path>.part and moved into place once
+    complete; a .part left by an interrupted run is resumed with a Range
+    request instead of being fetched again from the start. The .part's ETag
+    is kept in a sidecar and sent as If-Range, so a file that changed
+    upstream since the partial download began comes back whole.
+    Returns "downloaded" or "unchanged"; raises on failure.
+    """
+    part_path = output_path + '.part'
+    # Byte ranges only line up across requests for the unencoded body
+    headers = {'Accept-Encoding': 'identity'}
+    cached = validators.get(output_path) if os.path.exists(output_path) else None
+    if cached:
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+
+    resume_from = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    if resume_from:
+        headers['Range'] = f'bytes={resume_from}-'
+        part_etag = read_etag(part_path)
+        if part_etag:
+            headers['If-Range'] = part_etag
+
+    response = SESSION.get(url, stream=True, allow_redirects=True, headers=headers,
+                           timeout=TIMEOUT)
+    if response.status_code == 304:
+        response.close()
+        return "unchanged"
+    resumed = (response.status_code == 206 and
+               response.headers.get('Content-Range', '').startswith(f'bytes {resume_from}-'))
+    if response.status_code == 416 or (response.status_code == 206 and not resumed):
+        # The partial file doesn't line up with the server's copy; start over
+        response.close()
+        os.remove(part_path)
+        return fetch(url, output_path, validators)
+    response.raise_for_status()  # Raise an exception for HTTP errors
+
+    # A matching 206 continues the partial file; a plain 200 means the server
+    # ignored the Range (or If-Range found a newer version) and is sending
+    # the whole file again
+    if resumed:
+        f = open(part_path, 'r+b')
+        f.seek(resume_from)
+    else:
+        f = open(part_path, 'wb')
+        write_etag(part_path, response.headers.get('ETag'))
+
+    # Let the C-level copy loop move the body in 1 MiB blocks; decode_content
+    # keeps gzip/deflate transfer-encoding handled as iter_content did
+    response.raw.decode_content = True
+    with f:
+        # Reserve the rest of the file in one go rather than extending it
+        # block by block; the body is unencoded, so Content-Length is exact
+        length = int(response.headers.get('Content-Length') or 0)
+        if length and hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(f.fileno(), f.tell(), length)
+            except OSError:
+                pass  # Not supported by this filesystem
+        try:
+            shutil.copyfileobj(response.raw, f, length=COPY_BUFFER_SIZE)
+        finally:
+            # Drop any reserved space a broken transfer didn't fill, so the
+            # .part size stays the resume offset
+            f.truncate()
+    os.replace(part_path, output_path)
+    write_etag(part_path, None)
+
+    # dict item assignment is atomic, so workers can share the map
+    validators[output_path] = {
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+    }
+    return "downloaded"
+
+def download_file(url, output_path, validators):
+    """
+    Fetch a file, retrying a body that breaks off mid-transfer with jittered
+    backoff; everything up to the response headers is retried by SESSION.
+    Returns "downloaded", "unchanged", or None on failure.
+    Safe to call from several threads at once.
     """
     try:
-        print(f"Downloading: {url}")
-        
-        # Make the request with stream=True and verify=False to skip SSL verification
-        response = requests.get(url, stream=True, allow_redirects=True, verify=False)
-        response.raise_for_status()  # Raise an exception for HTTP errors
-        
-        # Get total file size if available
-        total_size = int(response.headers.get('content-length', 0))
-        
-        # Simple progress tracking
-        downloaded = 0
-        start_time = time.time()
-        
-        with open(output_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    size = f.write(chunk)
-                    downloaded += size
-                    
-                    # Update progress
-                    if total_size > 0:
-                        percent = (downloaded / total_size) * 100
-                        bar_length = 30
-                        filled_length = int(bar_length * downloaded // total_size)
-                        bar = '█' * filled_length + '░' * (bar_length - filled_length)
-                        
-                        # Calculate speed
-                        elapsed = time.time() - start_time
-                        if elapsed > 0:
-                            speed = downloaded / (1024 * elapsed)  # KB/s
-                            
-                            # Print progress bar
-                            sys.stdout.write(f"\r[{bar}] {percent:.1f}% ({downloaded/1024:.1f}/{total_size/1024:.1f} KB) {speed:.1f} KB/s")
-                            sys.stdout.flush()
-                    else:
-                        # If total size is unknown, just show downloaded amount
-                        sys.stdout.write(f"\rDownloaded: {downloaded/1024:.1f} KB")
-                        sys.stdout.flush()
-        
-        print(f"\n✓ Downloaded: {output_path}")
-        return True
+        for attempt in range(MAX_ATTEMPTS):
+            try:
+                return fetch(url, output_path, validators)
+            # The body is read straight off response.raw, so a dropped or
+            # stalled connection surfaces as urllib3's own exceptions
+            except (ProtocolError, ReadTimeoutError):
+                if attempt == MAX_ATTEMPTS - 1:
+                    raise
+                time.sleep(random.uniform(0, 0.5 * 2 ** attempt))
     except Exception as e:
-        print(f"\n❌ Failed to download: {url}")
-        print(f"Error: {e}")
+        report(f"❌ Failed to download: {url}\nError: {e}")
         log_error(url, output_path, e)
-        return False
+        return None
 
-# List of URLs and their corresponding output filenames
-files_to_download = [
+# URLs and their corresponding output filenames, built once at import
+FILES = (
     ("https://static.nhtsa.gov/nhtsa/downloads/FARS/1975/Release%20Notes%201975-1981.txt", "docs/research/Release_Notes_1975-1981.txt"),
     ("https://static.nhtsa.gov/nhtsa/downloads/FARS/1982/FARS%201982-1988%201990-2000%20Release%20Note.txt", "docs/research/FARS_1982-1988_1990-2000_Release_Note.txt"),
     ("https://static.nhtsa.gov/nhtsa/downloads/FARS/1989/FARS1989%20Release%20Note.txt", "docs/research/FARS1989_Release_Note.txt"),
@@ -89,27 +221,56 @@ files_to_download = [
     ("https://crashstats.nhtsa.dot.gov/Api/Public/ViewPublication/813545", "docs/research/NHTSA_Publication_813545.pdf"),
     ("https://crashstats.nhtsa.dot.gov/Api/Public/ViewPublication/813546", "docs/research/NHTSA_Publication_813546.pdf"),
     ("https://crashstats.nhtsa.dot.gov/Api/Public/ViewPublication/813547", "docs/research/NHTSA_Publication_813547.pdf"),
-]
+) + tuple(
+    # Annual release notes from 2012-2022; 2016-2019 use 'Note' instead of 'Notes'
+    (
+        f"https://static.nhtsa.gov/nhtsa/downloads/FARS/{year}/FARS{year}%20Release%20{'Note' if 2016 <= year <= 2019 else 'Notes'}.txt",
+        f"docs/research/FARS{year}_Release_Notes.txt",
+    )
+    for year in range(2012, 2023)
+)
 
-# Add annual release notes from 2012-2022
-for year in range(2012, 2023):
-    # Use 'Note' instead of 'Notes' for years 2016-2019
-    if 2016 <= year <= 2019:
-        url = f"https://static.nhtsa.gov/nhtsa/downloads/FARS/{year}/FARS{year}%20Release%20Note.txt"
-    else:
-        url = f"https://static.nhtsa.gov/nhtsa/downloads/FARS/{year}/FARS{year}%20Release%20Notes.txt"
-    output_path = f"docs/research/FARS{year}_Release_Notes.txt"
-    files_to_download.append((url, output_path))
+def main():
+    # Create the destination directory if it doesn't exist
+    os.makedirs('docs/research', exist_ok=True)
+
+    successful_downloads = 0
+    unchanged = 0
+    bytes_downloaded = 0
+    completed = 0
+    total_files = len(FILES)
+    validators = load_validators()
+
+    print(f"Starting download of {total_files} files to docs/research/ ({MAX_WORKERS} at a time)")
+    print("-" * 60)
 
-# Download all files
-successful_downloads = 0
-total_files = len(files_to_download)
+    # A per-chunk progress bar would garble the terminal with several downloads in
+    # flight, so progress is reported once per finished file instead, with a
+    # running byte total as the aggregate view
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {
+            executor.submit(download_file, url, output_path, validators): output_path
+            for url, output_path in FILES
+        }
+        for future in as_completed(futures):
+            completed += 1
+            status = future.result()
+            if status == "downloaded":
+                successful_downloads += 1
+                size = os.path.getsize(futures[future])
+                bytes_downloaded += size
+                report(f"[{completed}/{total_files}] ✓ Downloaded: {futures[future]} "
+                       f"({size / 1e6:.1f} MB, {bytes_downloaded / 1e6:.1f} MB total)")
+            elif status == "unchanged":
+                unchanged += 1
+                report(f"[{completed}/{total_files}] = Unchanged: {futures[future]}")
+            else:
+                report(f"[{completed}/{total_files}] ✗ Failed: {futures[future]}")
 
-print(f"Starting download of {total_files} files to docs/research/")
-print("-" * 60)
+    save_validators(validators)
 
-for url, output_path in files_to_download:
-    if download_file(url, output_path):
-        successful_downloads += 1
+    print(f"\nDownload summary: {successful_downloads}/{total_files} files downloaded successfully "
+          f"({bytes_downloaded / 1e6:.1f} MB), {unchanged} already up to date.")
 
-print(f"\nDownload summary: {successful_downloads}/{total_files} files downloaded successfully.")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
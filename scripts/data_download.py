@@ -1,136 +1,469 @@
+import functools
+import json
+import logging
 import requests
 import os
+import threading
 import time
-from urllib.parse import urljoin
+import zipfile
+import zlib
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-def download_file(url, output_dir):
+# Downloads are independent and network-bound, so fetch several at once
+MAX_WORKERS = 8
+
+# Connect/read timeouts for every request, in seconds
+TIMEOUT = (5, 60)
+
+# Bytes per read/write when saving an archive; 64 KiB keeps syscalls few
+# without holding much in memory
+CHUNK_SIZE = 1 << 16
+
+# One session for the whole run: every file comes from static.nhtsa.gov, so
+# the keep-alive connection is reused instead of a new TCP+TLS handshake per file
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=1,
+    pool_maxsize=16,
+    # Transient failures, including rate limiting, are retried on the pooled
+    # connection with jittered exponential backoff, honouring Retry-After
+    max_retries=Retry(
+        total=5,
+        backoff_factor=0.5,
+        backoff_jitter=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        respect_retry_after_header=True,
+    ),
+))
+# Keep Content-Length meaningful for the .zip payloads
+SESSION.headers["Accept-Encoding"] = "identity"
+
+# Failed downloads are logged here; download_fars_data attaches a file handler
+# under its base_dir for the length of the run
+error_log = logging.getLogger("fars_download.errors")
+error_log.propagate = False
+
+class RateLimiter:
+    """
+    Token bucket allowing `rate` requests per `per` seconds, with bursts of
+    up to `rate`. Safe to share between threads.
+    """
+    def __init__(self, rate, per=1.0):
+        self.capacity = rate
+        self.tokens = rate
+        self.fill_rate = rate / per
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent"""
+        with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                time.sleep((1 - self.tokens) / self.fill_rate)
+
+# NHTSA doesn't publish every region/type/format for every year; URLs that
+# answer 404 are saved here under base_dir and left out of later runs' plans
+KNOWN_MISSING_FILE = "known_missing.json"
+
+# Throttles every request sent to NHTSA, in download_file rather than per
+# loop iteration
+LIMITER = RateLimiter(4, per=1.0)
+
+def read_etag(path):
+    """Return the ETag saved next to a downloaded file, or None"""
+    try:
+        with open(path + ".etag") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def write_etag(path, etag):
+    """
+    Save a file's ETag in a sidecar so later runs can tell if it changed
+    upstream. Without an ETag, any sidecar left from an earlier version is
+    removed rather than left to describe the wrong bytes.
+    """
+    if etag:
+        with open(path + ".etag", "w") as f:
+            f.write(etag)
+    elif os.path.exists(path + ".etag"):
+        os.remove(path + ".etag")
+
+def is_current(url, output_path):
+    """
+    Checks a previously downloaded file against the server with a HEAD request.
+    
+    Returns:
+        bool: False if the local size differs from Content-Length (a truncated
+        download) or the saved ETag no longer matches (an upstream refresh)
+    """
+    LIMITER.acquire()
+    head = SESSION.head(url, allow_redirects=True, timeout=TIMEOUT)
+    head.raise_for_status()
+    
+    remote_size = head.headers.get("Content-Length")
+    if remote_size is not None and int(remote_size) != os.path.getsize(output_path):
+        return False
+    
+    etag = head.headers.get("ETag")
+    saved_etag = read_etag(output_path)
+    if saved_etag is None:
+        # Downloaded before ETags were tracked; the size matched, so adopt it
+        write_etag(output_path, etag)
+        return True
+    return etag is None or etag == saved_etag
+
+def supports_range(url):
+    """
+    Asks the server once for the first byte of `url` to learn whether it
+    honours Range requests; some servers advertise Accept-Ranges and then
+    send the whole file anyway.
+    
+    Returns:
+        bool: False only if the server answered a plain 200. Errors leave
+        resuming on, since download_file copes with a 200 either way.
+    """
+    LIMITER.acquire()
+    try:
+        with SESSION.get(url, headers={"Range": "bytes=0-0"}, stream=True, timeout=TIMEOUT) as response:
+            return response.status_code != 200
+    except requests.exceptions.RequestException:
+        return True
+
+@functools.lru_cache(maxsize=None)
+def ensure_dir(path):
+    """Create a directory once per run; later calls for the same path are free"""
+    os.makedirs(path, exist_ok=True)
+
+class UnverifiableZip(Exception):
+    """
+    The archive can't be checked: it has encrypted members or uses a
+    compression method (such as Deflate64) that zipfile doesn't support.
+    Downloading it again would give the same bytes.
+    """
+
+def check_zip(path):
+    """
+    Reads every member of a zip archive back and checks its CRC.
+    
+    This decompresses the whole archive once more after downloading it, so
+    it roughly doubles the local cost per file; the network transfer still
+    dominates.
+    
+    Raises:
+        zipfile.BadZipFile: If the archive is truncated or corrupt
+        UnverifiableZip: If the archive can't be read back to check it
+    """
+    try:
+        with zipfile.ZipFile(path) as zf:
+            bad_member = zf.testzip()
+    except (EOFError, zlib.error) as e:
+        raise zipfile.BadZipFile(f"{type(e).__name__}: {e}") from e
+    except NotImplementedError as e:
+        raise UnverifiableZip(str(e)) from e
+    except RuntimeError as e:
+        # zipfile reports encrypted members with a plain RuntimeError
+        if "encrypted" not in str(e):
+            raise
+        raise UnverifiableZip(str(e)) from e
+    if bad_member is not None:
+        raise zipfile.BadZipFile(f"bad CRC or header in {bad_member}")
+
+def download_file(url, output_dir, filename=None, retries=1, resume=True, not_found=None):
     """
     Downloads a file from a URL to the specified output directory.
     
     Args:
         url (str): URL of the file to download
         output_dir (str): Directory where the file will be saved
+        filename (str): Name to save the file under; defaults to the last
+            part of the URL
+        retries (int): How many times to download again if the archive
+            arrives truncated or corrupt
+        resume (bool): Whether to continue a partial download with a Range
+            request; pass False for servers that don't support it
+        not_found (set): If given, the URL is added to it when the server
+            answers 404
     
     Returns:
         str: Path to the downloaded file or None if the download failed
     """
     # Create the output directory if it doesn't exist
-    os.makedirs(output_dir, exist_ok=True)
+    ensure_dir(output_dir)
     
     # Get the filename from the URL
-    filename = url.split('/')[-1]
+    if filename is None:
+        filename = url.split('/')[-1]
     output_path = os.path.join(output_dir, filename)
     
-    # Check if the file already exists
+    # Check if the file already exists and is still complete and up to date
     if os.path.exists(output_path):
-        print(f"File {filename} already exists in {output_dir}, skipping download.")
-        return output_path
+        try:
+            current = is_current(url, output_path)
+        except requests.exceptions.RequestException as e:
+            print(f"Could not check {filename} against the server ({e}), keeping the local copy.")
+            current = True
+        if current:
+            print(f"File {filename} already exists in {output_dir} and is up to date, skipping download.")
+            return output_path
+        print(f"File {filename} in {output_dir} is incomplete or changed upstream, downloading again.")
     
     try:
-        print(f"Downloading {filename} from {url}...")
+        # Bytes go to a .part file first; if one is left from an interrupted
+        # run, ask only for the rest. If-Range makes the server send the whole
+        # file instead when it has changed since the partial download began.
+        part_path = output_path + ".part"
+        downloaded = os.path.getsize(part_path) if resume and os.path.exists(part_path) else 0
+        headers = {}
+        if downloaded:
+            headers["Range"] = f"bytes={downloaded}-"
+            part_etag = read_etag(part_path)
+            if part_etag:
+                headers["If-Range"] = part_etag
         
         # Download the file
-        response = requests.get(url, stream=True)
+        LIMITER.acquire()
+        response = SESSION.get(url, stream=True, timeout=TIMEOUT, headers=headers)
+        resumed = (response.status_code == 206 and
+                   response.headers.get("Content-Range", "").startswith(f"bytes {downloaded}-"))
+        if response.status_code == 416 or (response.status_code == 206 and not resumed):
+            # The partial file doesn't line up with the server's copy; start over
+            response.close()
+            os.remove(part_path)
+            LIMITER.acquire()
+            response = SESSION.get(url, stream=True, timeout=TIMEOUT)
         response.raise_for_status()  # Raise an exception for HTTP errors
         
+        # A 200 means the whole file is coming, even if a range was asked for
+        if resumed:
+            print(f"Resuming {filename} from byte {downloaded}...")
+        else:
+            write_etag(part_path, response.headers.get("ETag"))
+        
         # Save the file
-        with open(output_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
+        with open(part_path, 'ab' if resumed else 'wb') as f:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
                 if chunk:
                     f.write(chunk)
+            # Make sure the bytes are on disk before the rename can make the
+            # archive visible under its final name
+            f.flush()
+            os.fsync(f.fileno())
         
-        print(f"Successfully downloaded {filename} to {output_dir}")
-        
-        # Special case: Fix the incorrect filename for 1996 Auxiliary CSV
-        if "1996" in url and "AuxiliaryCVS.zip" in filename:
-            corrected_filename = filename.replace("CVS", "CSV")
-            corrected_output_path = os.path.join(output_dir, corrected_filename)
-            os.rename(output_path, corrected_output_path)
-            print(f"Renamed {filename} to {corrected_filename}")
-            return corrected_output_path
+        # Only a complete archive makes it to the final path. One that can't
+        # be checked is kept, since another download would be identical.
+        try:
+            check_zip(part_path)
+        except UnverifiableZip as e:
+            print(f"Warning: could not verify {filename} ({e}); keeping it unchecked.")
+            error_log.warning("URL: %s\nWarning: not verified: %s\n", url, e)
+        except zipfile.BadZipFile:
+            for path in (part_path, part_path + ".etag"):
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+        os.replace(part_path, output_path)
+        write_etag(part_path, None)
         
+        write_etag(output_path, response.headers.get("ETag"))
         return output_path
     
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, zipfile.BadZipFile) as e:
         print(f"Error downloading {url}: {e}")
         
-        # Log the error to a file
-        error_log_dir = os.path.join("data", "raw", "errors")
-        os.makedirs(error_log_dir, exist_ok=True)  # Ensure the directory exists
-        error_log_path = os.path.join(error_log_dir, "download_errors.txt")
+        if (not_found is not None and isinstance(e, requests.exceptions.HTTPError)
+                and e.response.status_code == 404):
+            not_found.add(url)
+        
+        if isinstance(e, zipfile.BadZipFile) and retries > 0:
+            print(f"Downloading {filename} again...")
+            return download_file(url, output_dir, filename, retries - 1, resume, not_found)
         
-        with open(error_log_path, "a") as error_log:
-            error_log.write(f"URL: {url}\nError: {e}\n\n")
+        # Log the error to a file
+        error_log.error("URL: %s\nError: %s\n", url, e)
         
         return None
 
-def download_fars_data(years, base_dir="data/raw"):
+# One file to fetch: where it comes from, where it goes, and how to describe it
+Job = namedtuple("Job", ["url", "out_dir", "out_name", "description"])
+
+# Regions to download, with the first year NHTSA publishes each
+REGIONS = (
+    ("National", 0),
+    ("Puerto Rico", 1978),
+)
+
+# File types to download (empty string means no suffix, the standard files),
+# with the first year each is available
+FILE_TYPES = (
+    ("", 0),
+    ("Auxiliary", 1982),
+)
+
+# File formats to download, as (suffix, description)
+FORMATS = (
+    ("CSV", "CSV format"),
+    ("SAS", "SAS format"),
+)
+
+# Each region's directory name in the URL (spaces encoded) and in the file name
+REGION_URL = {
+    "National": ("National", "National"),
+    "Puerto Rico": ("Puerto%20Rico", "PuertoRico"),
+}
+
+FILE_TMPL = "FARS{year}{rfile}{ftype}{suffix}.zip"
+URL_TMPL = "https://static.nhtsa.gov/nhtsa/downloads/FARS/{year}/{rpart}/" + FILE_TMPL
+
+def plan_downloads(years, base_dir="data/raw", regions=REGIONS, file_types=FILE_TYPES, formats=FORMATS):
     """
-    Downloads FARS data for the specified years in both CSV and SAS formats.
-    For years 1978 and onwards, also downloads Puerto Rico data.
-    For years 1982 and onwards, also downloads Auxiliary files.
+    Yields a Job for every FARS archive to download for the given years.
+    Regions and file types are skipped for years before they were published.
     
     Args:
         years (list): List of years to download data for
         base_dir (str): Base directory to save downloaded files
+        regions (tuple): (region, first_year) pairs to download
+        file_types (tuple): (file_type, first_year) pairs to download
+        formats (tuple): (suffix, description) pairs to download
     """
-    base_url = "https://static.nhtsa.gov/nhtsa/downloads/FARS/"
-    
     for year in years:
         year_str = str(year)
         
         # Create year-specific output directory
         year_dir = os.path.join(base_dir, year_str)
         
-        # Base file types to download
-        file_types = [""]  # Standard files (empty string means no suffix)
-        
-        # Add Auxiliary files for years 1982 and onwards
-        if year >= 1982:
-            file_types.append("Auxiliary")
-        
-        # File formats to download
-        formats = [
-            {"suffix": "CSV", "description": "CSV format"},
-            {"suffix": "SAS", "description": "SAS format"}
-        ]
-        
-        # Regions to download
-        regions = ["National"]
-        
-        # Add Puerto Rico for years 1978 and onwards
-        if year >= 1978:
-            regions.append("Puerto Rico")
-        
-        print(f"\nProcessing year {year_str}...")
-        
-        for region in regions:
-            region_url_part = region.replace(" ", "%20")  # URL encode spaces
-            region_file_part = region.replace(" ", "")    # Remove spaces for filename
+        for region, region_since in regions:
+            if year < region_since:
+                continue
+            region_url_part, region_file_part = REGION_URL[region]
             
-            for file_type in file_types:
-                for format_info in formats:
-                    # Special case for 1996 Auxiliary CSV file
-                    if year == 1996 and file_type == "Auxiliary" and format_info["suffix"] == "CSV":
-                        file_url = urljoin(base_url, f"{year_str}/{region_url_part}/FARS{year_str}{region_file_part}{file_type}CVS.zip")
+            for file_type, file_type_since in file_types:
+                if year < file_type_since:
+                    continue
+                
+                # Create description for logging
+                type_desc = f" {file_type}" if file_type else ""
+                
+                for suffix, format_desc in formats:
+                    # Special case: NHTSA misnames the 1996 Auxiliary CSV file
+                    # "CVS"; fetch it from there but save it under the CSV name
+                    if year == 1996 and file_type == "Auxiliary" and suffix == "CSV":
+                        url_suffix = "CVS"
                     else:
-                        # Construct the URL for the file
-                        file_url = urljoin(base_url, f"{year_str}/{region_url_part}/FARS{year_str}{region_file_part}{file_type}{format_info['suffix']}.zip")
-                    
-                    # Create description for logging
-                    type_desc = f" {file_type}" if file_type else ""
-                    
-                    # Download the file
-                    print(f"Attempting to download {region}{type_desc} {format_info['description']} for {year_str}...")
-                    downloaded_file = download_file(file_url, year_dir)
+                        url_suffix = suffix
                     
-                    if downloaded_file:
-                        print(f"FARS {region}{type_desc} {format_info['description']} for {year_str} downloaded successfully.")
-                    else:
-                        print(f"Failed to download FARS {region}{type_desc} {format_info['description']} for {year_str}.")
+                    # Construct the URL for the file
+                    file_url = URL_TMPL.format(year=year_str, rpart=region_url_part, rfile=region_file_part,
+                                               ftype=file_type, suffix=url_suffix)
+                    out_name = FILE_TMPL.format(year=year_str, rfile=region_file_part, ftype=file_type, suffix=suffix)
                     
-                    # Add a small delay to avoid overwhelming the server
-                    time.sleep(1)
+                    yield Job(file_url, year_dir, out_name, f"{region}{type_desc} {format_desc} for {year_str}")
+
+def load_known_missing(base_dir):
+    """Return the set of URLs earlier runs found missing upstream"""
+    try:
+        with open(os.path.join(base_dir, KNOWN_MISSING_FILE)) as f:
+            return set(json.load(f))
+    except (FileNotFoundError, ValueError):
+        return set()
+
+def save_known_missing(base_dir, urls):
+    """Write the known-missing URL list atomically"""
+    path = os.path.join(base_dir, KNOWN_MISSING_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(sorted(urls), f, indent=2)
+    os.replace(path + ".tmp", path)
+
+def download_fars_data(years, base_dir="data/raw", regions=REGIONS, file_types=FILE_TYPES, formats=FORMATS,
+                       skip_known_missing=True):
+    """
+    Downloads FARS data for the specified years in both CSV and SAS formats.
+    For years 1978 and onwards, also downloads Puerto Rico data.
+    For years 1982 and onwards, also downloads Auxiliary files.
+    
+    Args:
+        years (list): List of years to download data for
+        base_dir (str): Base directory to save downloaded files
+        regions, file_types, formats: Subsets of REGIONS, FILE_TYPES and
+            FORMATS to restrict the download to
+        skip_known_missing (bool): Leave out files that returned 404 on an
+            earlier run; pass False to check them again
+    """
+    # Plan the whole run up front so downloading is a single pass over a flat list
+    known_missing = load_known_missing(base_dir)
+    jobs = list(plan_downloads(years, base_dir, regions, file_types, formats))
+    if skip_known_missing:
+        planned = len(jobs)
+        jobs = [job for job in jobs if job.url not in known_missing]
+        if planned > len(jobs):
+            print(f"Skipping {planned - len(jobs)} files known to be missing upstream.")
+    print(f"Planned {len(jobs)} files to download ({MAX_WORKERS} at a time).")
+    
+    # Create each year directory once here rather than from every worker
+    for out_dir in {job.out_dir for job in jobs}:
+        ensure_dir(out_dir)
+    
+    # Every archive comes from the same server, so one probe decides whether
+    # partial downloads can be resumed
+    resume = bool(jobs) and supports_range(jobs[0].url)
+    if not resume:
+        print("Server ignores Range requests; partial downloads will restart from the beginning.")
+    
+    # Workers only print when something is unusual (skips, resumes, errors);
+    # progress is one line per finished file with a running total, printed
+    # from this thread
+    completed = 0
+    failed = 0
+    total_bytes = 0
+    found = set()
+    # URLs that answer 404 in this run; set.add is atomic, so workers share it
+    not_found = set()
+    
+    # Failed downloads are appended to <base_dir>/errors/download_errors.txt
+    # through one handler for the whole run; delay=True leaves the file alone
+    # until the first error
+    error_dir = os.path.join(base_dir, "errors")
+    ensure_dir(error_dir)
+    handler = logging.FileHandler(os.path.join(error_dir, "download_errors.txt"), delay=True)
+    error_log.addHandler(handler)
+    try:
+        # The shared session, rate limiter and error log are all thread-safe
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            futures = {
+                executor.submit(download_file, job.url, job.out_dir, job.out_name,
+                                resume=resume, not_found=not_found): job
+                for job in jobs
+            }
+            for future in as_completed(futures):
+                completed += 1
+                job = futures[future]
+                downloaded_file = future.result()
+                if downloaded_file:
+                    found.add(job.url)
+                    total_bytes += os.path.getsize(downloaded_file)
+                    print(f"[{completed}/{len(jobs)}] ✓ FARS {job.description} ({total_bytes / 1e6:.1f} MB total)")
+                else:
+                    failed += 1
+                    print(f"[{completed}/{len(jobs)}] ✗ Failed: FARS {job.description}")
+    finally:
+        error_log.removeHandler(handler)
+        handler.close()
+    
+    print(f"\n{len(jobs) - failed}/{len(jobs)} files available ({total_bytes / 1e6:.1f} MB), {failed} failed.")
+    
+    updated_missing = (known_missing | not_found) - found
+    if updated_missing != known_missing:
+        save_known_missing(base_dir, updated_missing)
 
 if __name__ == "__main__":
     # Years to download
@@ -1,13 +1,21 @@
+import itertools
+import json
 import os
+import threading
 import time
 
 import psycopg2
 import psycopg2.extras
 import psycopg2.pool
 import requests as _requests
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, Response, jsonify, request, send_from_directory
 from dotenv import load_dotenv
 
+try:
+    import orjson  # optional: faster JSON encoding for /api/incidents
+except ImportError:
+    orjson = None
+
 load_dotenv()
 
 app = Flask(__name__, static_folder='../frontend', static_url_path='')
@@ -111,9 +119,19 @@ def data_status():
     return jsonify(result)
 
 
+# The per-year counts scan the whole table and only change when the ETL runs
+_summary_cache = {'result': None, 'ts': 0}
+_SUMMARY_TTL = 300  # 5 minutes
+
+
 @app.route('/api/summary')
 def summary():
     """Return total incident count per year across all loaded years."""
+    global _summary_cache
+
+    if time.time() - _summary_cache['ts'] < _SUMMARY_TTL and _summary_cache['result'] is not None:
+        return jsonify(_summary_cache['result'])
+
     try:
         with _PooledConn() as conn:
             with conn.cursor() as cur:
@@ -121,10 +139,48 @@ def summary():
                     'SELECT year, COUNT(*) AS count FROM incidents GROUP BY year ORDER BY year'
                 )
                 rows = cur.fetchall()
-        return jsonify({str(r['year']): r['count'] for r in rows})
     except Exception as exc:
         return jsonify({'error': str(exc)}), 503
 
+    result = {str(r['year']): r['count'] for r in rows}
+    _summary_cache = {'result': result, 'ts': time.time()}
+    return jsonify(result)
+
+
+# ── Incident filters ─────────────────────────────────────────────────────────
+# Time-of-day buckets: dawn (lgt_cond=4), day (lgt_cond=1), dusk (lgt_cond=5),
+#                      night (lgt_cond IN 2,3,6)
+TOD_SQL = {
+    'dawn':  'lgt_cond = 4',
+    'day':   'lgt_cond = 1',
+    'dusk':  'lgt_cond = 5',
+    'night': 'lgt_cond IN (2, 3, 6)',
+}
+
+# Road types: interstate: route=1; highway: route IN (2,3); local: route IN (4,5,6,7)
+ROAD_SQL = {
+    'interstate': 'route = 1',
+    'highway':    'route IN (2, 3)',
+    'local':      'route IN (4, 5, 6, 7)',
+}
+
+# A streaming response holds its pool connection until the client has read
+# it all, so a few slow clients could otherwise take every connection. At
+# most this many stream at once; further requests fetch their rows in full
+# and return the connection before sending.
+_MAX_STREAMS = 4
+_stream_slots = threading.BoundedSemaphore(_MAX_STREAMS)
+
+
+def _putconn(conn):
+    """Roll back and return a connection; one too broken to roll back is closed."""
+    try:
+        conn.rollback()
+    except psycopg2.Error:
+        _get_pool().putconn(conn, close=True)
+    else:
+        _get_pool().putconn(conn)
+
 
 @app.route('/api/incidents')
 def incidents():
@@ -167,57 +223,100 @@ def incidents():
         params.extend([min_lon, min_lat, max_lon, max_lat])
 
     # ── time-of-day filter (derived from hour + lgt_cond)
-    # Buckets: dawn (lgt_cond=4), day (lgt_cond=1), dusk (lgt_cond=5),
-    #          night (lgt_cond IN 2,3,6)
-    TOD_SQL = {
-        'dawn':  'lgt_cond = 4',
-        'day':   'lgt_cond = 1',
-        'dusk':  'lgt_cond = 5',
-        'night': 'lgt_cond IN (2, 3, 6)',
-    }
     valid_tod = [t for t in time_of_day if t in TOD_SQL]
     if valid_tod:
         clauses = ' OR '.join(TOD_SQL[t] for t in valid_tod)
         query += f' AND ({clauses})'
 
     # ── road-type filter
-    # interstate: route=1; highway: route IN (2,3); local: route IN (4,5,6,7)
-    ROAD_SQL = {
-        'interstate': 'route = 1',
-        'highway':    'route IN (2, 3)',
-        'local':      'route IN (4, 5, 6, 7)',
-    }
     valid_road = [r for r in road_type if r in ROAD_SQL]
     if valid_road:
         clauses = ' OR '.join(ROAD_SQL[r] for r in valid_road)
         query += f' AND ({clauses})'
 
+    # Server-side cursor: rows come from Postgres itersize at a time while the
+    # response is written, instead of the whole result set up front. The
+    # first batch is fetched here, so a failing query is still a 503; an
+    # error after the response has started can only cut the body short,
+    # which leaves the client with invalid JSON rather than a partial map.
+    conn = None
+    streaming = _stream_slots.acquire(blocking=False)
     try:
-        with _PooledConn() as conn:
-            with conn.cursor() as cur:
-                cur.execute(query, params)
-                rows = cur.fetchall()
+        conn = _get_pool().getconn()
+        if streaming:
+            cur = conn.cursor(name='incidents')
+            cur.execute(query, params)
+            first = cur.fetchmany(cur.itersize)
+        else:
+            cur = conn.cursor()
+            cur.execute(query, params)
+            first = cur.fetchall()
     except Exception as exc:
+        try:
+            if conn is not None:
+                _putconn(conn)
+        finally:
+            if streaming:
+                _stream_slots.release()
         return jsonify({'error': str(exc)}), 503
 
-    features = [
-        {
-            'type': 'Feature',
-            'geometry': {
-                'type': 'Point',
-                'coordinates': [row['lon'], row['lat']],
-            },
-            'properties': {
-                k: v for k, v in row.items() if k not in ('lon', 'lat')
-            },
-        }
-        for row in rows
-    ]
-
-    return jsonify({
-        'type': 'FeatureCollection',
-        'features': features,
-    })
+    def release():
+        try:
+            cur.close()
+        finally:
+            try:
+                _putconn(conn)
+            finally:
+                if streaming:
+                    _stream_slots.release()
+
+    if not streaming or len(first) < cur.itersize:
+        # The whole result is already here; don't hold the connection while
+        # it is sent
+        release()
+        return Response(_feature_collection(first), mimetype='application/json')
+
+    response = Response(_feature_collection(itertools.chain(first, cur)),
+                        mimetype='application/json')
+    response.call_on_close(release)
+    return response
+
+
+# Everything but the coordinates and properties is identical for every
+# feature, so the skeleton is formatted as a string rather than encoded from
+# nested dicts per row. geom is NOT NULL, so lon/lat are always finite floats,
+# whose repr() is their JSON form.
+_FEATURE_TMPL = '{"type":"Feature","geometry":{"type":"Point","coordinates":[%r,%r]},"properties":%s}'
+
+if orjson is not None:
+    def _encode(obj):
+        return orjson.dumps(obj).decode()
+else:
+    _encode = json.JSONEncoder(separators=(',', ':')).encode
+
+
+def _feature_collection(rows, features_per_chunk=1000):
+    """Yield a GeoJSON FeatureCollection in chunks of serialised features.
+
+    A full-history query returns 100k+ rows; streaming avoids holding both
+    the feature dicts and the complete JSON document in memory at once.
+    The rows are consumed: lon/lat are popped off each one.
+    """
+    yield '{"type":"FeatureCollection","features":['
+    chunk = []
+    sep = ''
+    for row in rows:
+        # Take the coordinates out of the row; what's left is the properties,
+        # so no per-key filtering copy is needed
+        lon = row.pop('lon')
+        lat = row.pop('lat')
+        chunk.append(sep + _FEATURE_TMPL % (lon, lat, _encode(row)))
+        sep = ','
+        if len(chunk) >= features_per_chunk:
+            yield ''.join(chunk)
+            chunk.clear()
+    chunk.append(']}')
+    yield ''.join(chunk)
 
 
 if __name__ == '__main__':
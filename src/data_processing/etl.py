@@ -4,44 +4,60 @@ ETL: FARS National CSV zips → PostGIS incidents table.
 Usage:
     python -m src.data_processing.etl --years 2022 --data-dir data/raw
     python -m src.data_processing.etl --years 2010-2022 --data-dir data/raw
+    python -m src.data_processing.etl --years 2001-2023 --rebuild-indexes
 """
 
 import argparse
 import csv
+import functools
 import io
+import operator
 import os
+import queue
 import sys
+import threading
 import zipfile
+from collections.abc import Iterator
 from pathlib import Path
 
 import psycopg2
+from psycopg2 import sql
 from dotenv import load_dotenv
 
 load_dotenv()
 
-# Sentinel values that indicate missing/not-reported coordinates
-LAT_SENTINELS = {'', '77.7777', '99.9999', '88.8888', '0', '0.0'}
-LON_SENTINELS = {'', '77.7777', '99.9999', '888.8888', '0', '0.0'}
-
-
-def _sentinel(val: str, sentinels: set) -> bool:
-    v = val.strip()
-    if v in sentinels:
-        return True
+# Rows are buffered and streamed with COPY rather than INSERTed one at a time
+COPY_COLUMNS = (
+    'geom', 'year', 'month', 'day', 'hour', 'minute',
+    'lgt_cond', 'weather', 'route', 'rur_urb',
+    'state', 'county', 'age', 'sex', 'inj_sev',
+)
+COPY_SQL = f"COPY incidents ({', '.join(COPY_COLUMNS)}) FROM STDIN WITH (FORMAT csv)"
+COPY_BATCH_SIZE = 10_000
+
+# Only these columns are pulled out of ACCIDENT.csv / PERSON.csv. The trailing
+# ACCIDENT columns are in the same order as their COPY_COLUMNS counterparts.
+ACC_COLUMNS = (
+    'st_case', 'latitude', 'longitud',
+    'month', 'day', 'hour', 'minute',
+    'lgt_cond', 'weather', 'route', 'rur_urb',
+    'state', 'county',
+)
+PER_COLUMNS = ('st_case', 'age', 'sex', 'inj_sev')
+PEDESTRIAN = ('per_typ', '5')
+
+
+# FARS codes have tiny cardinality (months, hours, a few hundred counties and
+# ages), so almost every call is a cache hit; blanks, which would otherwise
+# raise twice, are the biggest saving.
+@functools.lru_cache(maxsize=4096)
+def _int_or_none(val: str) -> int | None:
     try:
-        # Also catch values outside plausible US bounds
-        f = float(v)
-        return f == 0.0
+        return int(val)  # FARS codes are plain integers; int() ignores whitespace
     except ValueError:
-        return True
-
-
-def _int_or_none(val: str) -> int | None:
-    v = val.strip()
-    if not v:
-        return None
+        pass
     try:
-        return int(float(v))
+        return int(float(val))  # the odd '12.0'
     except ValueError:
         return None
 
@@ -54,18 +70,114 @@ def _find_csv(zf: zipfile.ZipFile, name: str) -> str | None:
     return None
 
 
-def _read_csv_from_zip(zf: zipfile.ZipFile, member: str) -> list[dict]:
+def _read_csv_from_zip(zf: zipfile.ZipFile, member: str,
+                       columns: tuple[str, ...],
+                       where: tuple[str, str] | None = None) -> Iterator[tuple[str, ...]]:
+    """Stream the named columns (case-insensitive) from a zip member.
+
+    Rows are yielded as tuples in the order of `columns`; a column missing
+    from the file (e.g. rur_urb in early years) reads as ''. Positions are
+    resolved once from the header, so each row is a single itemgetter call.
+    `where=(column, value)` drops non-matching rows before they are projected.
+    Blank lines are skipped and short rows are padded with ''.
+    """
     with zf.open(member) as f:
-        text = io.TextIOWrapper(f, encoding='latin-1')
-        return list(csv.DictReader(text))
+        reader = csv.reader(io.TextIOWrapper(f, encoding='latin-1', newline=''))
+        header = [name.lower().strip() for name in next(reader, [])]
+        # Absent columns point one past the end, at a '' padded onto each row
+        positions = [header.index(c) if c in header else len(header) for c in columns]
+        pick = operator.itemgetter(*positions)
+        if where is not None:
+            column, value = where
+            if column not in header:
+                return
+            i = header.index(column)
+            width = max(*positions, i) + 1
+        else:
+            width = max(positions) + 1
+        reader = (
+            row if len(row) >= width else row + [''] * (width - len(row))
+            for row in reader if row
+        )
+        if where is not None:
+            reader = (row for row in reader if row[i].strip() == value)
+        yield from map(pick, reader)
+
+
+def _flush_copy(cur, rows: list[tuple]) -> None:
+    """Stream buffered rows into incidents with COPY, then empty the buffer."""
+    if not rows:
+        return
+    buf = io.StringIO()
+    csv.writer(buf, lineterminator='\n').writerows(rows)
+    buf.seek(0)
+    cur.copy_expert(COPY_SQL, buf)
+    rows.clear()
+
+
+class _CopyWriter:
+    """Runs COPY batches on a background thread.
+
+    psycopg2 releases the GIL while libpq ships data to the server, so CSV
+    parsing for the next batch overlaps with the previous batch's COPY. The
+    bounded queue keeps at most a few batches in flight.
+    """
+
+    def __init__(self, conn, max_pending: int = 4):
+        self._conn = conn
+        self._queue: queue.Queue[list[tuple] | None] = queue.Queue(maxsize=max_pending)
+        self._error: BaseException | None = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        with self._conn.cursor() as cur:
+            while (rows := self._queue.get()) is not None:
+                if self._error is not None:
+                    continue  # keep draining so put() never blocks forever
+                try:
+                    _flush_copy(cur, rows)
+                except BaseException as exc:
+                    self._error = exc
+
+    def put(self, rows: list[tuple]) -> None:
+        if self._error is not None:
+            raise self._error
+        self._queue.put(rows)
+
+    def close(self) -> None:
+        """Wait for queued batches to finish; re-raise any COPY failure."""
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+
+def _accident_fields(acc: tuple[str, ...], year: int) -> tuple | None:
+    """Return the crash-level COPY columns for an ACCIDENT row, or None if its
+    coordinates are missing or implausible."""
+    _, lat, lon, *codes = acc
+
+    try:
+        lat_f = float(lat)
+        lon_f = float(lon)
+    except ValueError:  # blank / not reported
+        return None
 
+    # US bounds (inclusive of territories). This also rejects FARS's
+    # not-reported sentinels (0, 77.7777, 88.8888, 99.9999, 888.8888) and NaN.
+    if not (-180 <= lon_f <= -60) or not (15 <= lat_f <= 72):
+        return None
 
-def _normalise(row: dict) -> dict:
-    """Return dict with lowercased keys."""
-    return {k.lower().strip(): v.strip() for k, v in row.items()}
+    # geom goes in as EWKT; None becomes an empty (NULL) CSV field
+    return (
+        f'SRID=4326;POINT({lon_f} {lat_f})',
+        year,
+        *(_int_or_none(v) for v in codes),
+    )
 
 
-def process_year(year: int, data_dir: Path, conn) -> int:
+def process_year(year: int, data_dir: Path, conn, commit: bool = True) -> int:
     zip_path = data_dir / str(year) / f'FARS{year}NationalCSV.zip'
     if not zip_path.exists():
         print(f'  [{year}] zip not found: {zip_path}', file=sys.stderr)
@@ -81,82 +193,106 @@ def process_year(year: int, data_dir: Path, conn) -> int:
             return 0
 
         accidents = {
-            row['st_case']: row
-            for row in (_normalise(r) for r in _read_csv_from_zip(zf, acc_member))
+            row[0].strip(): row for row in _read_csv_from_zip(zf, acc_member, ACC_COLUMNS)
         }
-        persons = [
-            _normalise(r) for r in _read_csv_from_zip(zf, per_member)
-            if _normalise(r).get('per_typ', '').strip() == '5'
-        ]
+        # Only pedestrian rows get past the reader; the ~90% of PERSON rows that
+        # are vehicle occupants are never projected or looked at again
+        persons = _read_csv_from_zip(zf, per_member, PER_COLUMNS, where=PEDESTRIAN)
+
+        inserted = 0
+        skipped = 0
+        batch: list[tuple] = []
+        # Crash-level columns, converted once per crash rather than once per pedestrian
+        crash_fields: dict[str, tuple | None] = {}
+
+        # PERSON rows are streamed straight into COPY batches, so only a few
+        # batches of pedestrians are held in memory at a time
+        writer = _CopyWriter(conn)
+        try:
+            for st_case, age, sex, inj_sev in persons:
+                st_case = st_case.strip()
+                if st_case in crash_fields:
+                    acc = crash_fields[st_case]
+                else:
+                    row = accidents.get(st_case)
+                    acc = crash_fields[st_case] = None if row is None else _accident_fields(row, year)
+                if acc is None:  # unknown crash or unusable coordinates
+                    skipped += 1
+                    continue
+
+                batch.append(acc + (
+                    _int_or_none(age), _int_or_none(sex), _int_or_none(inj_sev),
+                ))
+                inserted += 1
+                if len(batch) >= COPY_BATCH_SIZE:
+                    writer.put(batch)
+                    batch = []
+
+            writer.put(batch)
+        finally:
+            writer.close()
+        if commit:
+            conn.commit()
+
+    print(f'  [{year}] {inserted + skipped} pedestrian person records found')
+    print(f'  [{year}] inserted {inserted}, skipped {skipped}')
+    return inserted
 
-    print(f'  [{year}] {len(persons)} pedestrian person records found')
 
-    inserted = 0
-    skipped = 0
+def _tune_session(conn) -> None:
+    """Relax per-session settings for the bulk load.
 
+    With synchronous_commit off, a commit returns before its WAL is flushed;
+    a server crash can lose the last few committed years, but never corrupts
+    the table, and FARS data can simply be reloaded. The extra maintenance
+    memory speeds up the index rebuild at the end.
+    """
     with conn.cursor() as cur:
-        for per in persons:
-            st_case = per.get('st_case', '')
-            acc = accidents.get(st_case)
-            if acc is None:
-                skipped += 1
-                continue
-
-            lat = acc.get('latitude', '').strip()
-            lon = acc.get('longitud', '').strip()
-
-            if _sentinel(lat, LAT_SENTINELS) or _sentinel(lon, LON_SENTINELS):
-                skipped += 1
-                continue
-
-            try:
-                lat_f = float(lat)
-                lon_f = float(lon)
-            except ValueError:
-                skipped += 1
-                continue
-
-            # Sanity-check US bounds (inclusive of territories)
-            if not (-180 <= lon_f <= -60) or not (15 <= lat_f <= 72):
-                skipped += 1
-                continue
-
-            cur.execute(
-                """
-                INSERT INTO incidents
-                    (geom, year, month, day, hour, minute,
-                     lgt_cond, weather, route, rur_urb,
-                     state, county, age, sex, inj_sev)
-                VALUES
-                    (ST_SetSRID(ST_MakePoint(%s, %s), 4326),
-                     %s, %s, %s, %s, %s,
-                     %s, %s, %s, %s,
-                     %s, %s, %s, %s, %s)
-                """,
-                (
-                    lon_f, lat_f,
-                    year,
-                    _int_or_none(acc.get('month', '')),
-                    _int_or_none(acc.get('day', '')),
-                    _int_or_none(acc.get('hour', '')),
-                    _int_or_none(acc.get('minute', '')),
-                    _int_or_none(acc.get('lgt_cond', '')),
-                    _int_or_none(acc.get('weather', '')),
-                    _int_or_none(acc.get('route', '')),
-                    _int_or_none(acc.get('rur_urb', '')),
-                    _int_or_none(acc.get('state', '')),
-                    _int_or_none(acc.get('county', '')),
-                    _int_or_none(per.get('age', '')),
-                    _int_or_none(per.get('sex', '')),
-                    _int_or_none(per.get('inj_sev', '')),
-                ),
-            )
-            inserted += 1
-
-        conn.commit()
+        cur.execute("SET synchronous_commit = off")
+        cur.execute("SET maintenance_work_mem = '512MB'")
+    conn.commit()
 
-    print(f'  [{year}] inserted {inserted}, skipped {skipped}')
-    return inserted
+
+def _has_rows(conn) -> bool:
+    with conn.cursor() as cur:
+        cur.execute('SELECT EXISTS (SELECT 1 FROM incidents)')
+        return cur.fetchone()[0]
+
+
+def _drop_indexes(conn) -> list[str]:
+    """Drop the secondary indexes on incidents and return their definitions.
+
+    Maintaining the GiST and btree indexes row by row dominates a large load;
+    building them once afterwards is much cheaper. The drop is left
+    uncommitted, so the load and rebuild must run in the same transaction:
+    if anything fails before the final commit, rolling back (or the server
+    dropping the connection) restores the indexes. Until then the drop's
+    ACCESS EXCLUSIVE lock blocks every reader of incidents.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT indexname, indexdef
+            FROM pg_indexes
+            WHERE schemaname = current_schema()
+              AND tablename = 'incidents'
+              AND indexname NOT IN (
+                  SELECT conname FROM pg_constraint
+                  WHERE conrelid = 'incidents'::regclass
+              )
+            """
+        )
+        indexes = cur.fetchall()
+        for name, ddl in indexes:
+            print(f'  dropping {name}: {ddl}')
+            cur.execute(sql.SQL('DROP INDEX {}').format(sql.Identifier(name)))
+    return [ddl for _, ddl in indexes]
+
+
+def _create_indexes(conn, ddls: list[str]) -> None:
+    with conn.cursor() as cur:
+        for ddl in ddls:
+            cur.execute(ddl)
 
 
 def parse_year_range(spec: str) -> list[int]:
@@ -167,11 +303,22 @@ def parse_year_range(spec: str) -> list[int]:
 
 
 def main():
-    parser = argparse.ArgumentParser(description='Load FARS pedestrian data into PostGIS')
+    parser = argparse.ArgumentParser(
+        description='Load FARS pedestrian data into PostGIS',
+        epilog='The load runs with synchronous_commit off: a database crash '
+               'mid-run may lose recently committed years, which can simply '
+               'be re-imported.',
+    )
     parser.add_argument('--years', required=True,
                         help='Year or range, e.g. 2022 or 2010-2022')
     parser.add_argument('--data-dir', default='data/raw',
                         help='Path to directory containing per-year FARS zips')
+    parser.add_argument('--rebuild-indexes', action='store_true',
+                        help='Drop the secondary indexes and rebuild them after '
+                             'the load (faster for a full load into an empty table). '
+                             'All years then load in a single transaction that locks '
+                             'incidents, so API queries block until the load '
+                             'finishes: use for initial or offline loads only')
     args = parser.parse_args()
 
     years = parse_year_range(args.years)
@@ -182,11 +329,30 @@ def main():
         print('DATABASE_URL not set', file=sys.stderr)
         sys.exit(1)
 
+    # One connection serves every year; it is only opened and torn down once
     conn = psycopg2.connect(db_url)
     total = 0
-    for year in years:
-        total += process_year(year, data_dir, conn)
-    conn.close()
+    try:
+        _tune_session(conn)
+        if args.rebuild_indexes:
+            # Drop, load and rebuild in one transaction, so a failure or a
+            # killed process can never leave the table without its indexes.
+            # DROP INDEX holds an exclusive lock on incidents until the commit.
+            if _has_rows(conn):
+                print('Warning: incidents already has rows; API queries will '
+                      'block until the load and index rebuild finish',
+                      file=sys.stderr)
+            saved_indexes = _drop_indexes(conn)
+            for year in years:
+                total += process_year(year, data_dir, conn, commit=False)
+            print(f'Rebuilding {len(saved_indexes)} index(es)...')
+            _create_indexes(conn, saved_indexes)
+            conn.commit()
+        else:
+            for year in years:
+                total += process_year(year, data_dir, conn)
+    finally:
+        conn.close()
 
     print(f'\nDone. Total inserted: {total}')
 
@@ -0,0 +1,180 @@
+import json
+import os
+import unittest
+
+import psycopg2
+
+os.environ.setdefault('DATABASE_URL', 'postgresql://localhost/test')
+
+from src.backend import app as backend
+
+
+def _row(i):
+    return {
+        'id': i, 'lon': -86.69 + i / 1000, 'lat': 33.54, 'year': 2022,
+        'month': 1, 'day': 2, 'hour': 18, 'minute': 48, 'lgt_cond': 2,
+        'weather': 1, 'route': 5, 'rur_urb': None, 'state': 1, 'county': 73,
+        'age': 27, 'sex': 1, 'inj_sev': 4,
+    }
+
+
+class _Cursor:
+    itersize = 2000
+
+    def __init__(self, rows):
+        self._rows = rows
+
+    def execute(self, query, params=None):
+        if isinstance(self._rows, Exception):
+            raise self._rows
+        self._rows = [dict(r) for r in self._rows]
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def fetchmany(self, size):
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self):
+        pass
+
+
+class _Pool:
+    def __init__(self, rows, broken=False):
+        self.rows = rows
+        self.broken = broken
+        self.checked_out = 0
+        self.closed = 0
+
+    def getconn(self):
+        self.checked_out += 1
+        pool = self
+
+        class Conn:
+            def cursor(self, name=None):
+                return _Cursor(pool.rows)
+
+            def rollback(self):
+                if pool.broken:
+                    raise psycopg2.InterfaceError('connection already closed')
+
+        return Conn()
+
+    def putconn(self, conn, close=False):
+        self.checked_out -= 1
+        self.closed += close
+
+
+class IncidentsResponseTest(unittest.TestCase):
+    """Pin the GeoJSON document the frontend reads from /api/incidents."""
+
+    def setUp(self):
+        self.client = backend.app.test_client()
+
+    def tearDown(self):
+        backend._pool = None
+
+    def _get(self, rows):
+        backend._pool = pool = _Pool(rows)
+        response = self.client.get('/api/incidents?year=2022')
+        body = response.get_data(as_text=True)
+        response.close()
+        self.assertEqual(pool.checked_out, 0)
+        return response, body
+
+    def _checked_out_before_body(self, rows):
+        """Return how many connections are held once the response has started."""
+        backend._pool = pool = _Pool(rows)
+        response = self.client.get('/api/incidents?year=2022')
+        held = pool.checked_out
+        self.assertEqual(len(json.loads(response.get_data(as_text=True))['features']), len(rows))
+        response.close()
+        self.assertEqual(pool.checked_out, 0)
+        return held
+
+    def test_feature_collection_shape(self):
+        rows = [_row(i) for i in range(2500)]
+        response, body = self._get(rows)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/json')
+        expected = {
+            'type': 'FeatureCollection',
+            'features': [
+                {
+                    'type': 'Feature',
+                    'geometry': {'type': 'Point', 'coordinates': [r['lon'], r['lat']]},
+                    'properties': {k: v for k, v in r.items() if k not in ('lon', 'lat')},
+                }
+                for r in rows
+            ],
+        }
+        self.assertEqual(json.loads(body), expected)
+
+    def test_empty_result(self):
+        response, body = self._get([])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(body), {'type': 'FeatureCollection', 'features': []})
+
+    def test_stdlib_encoder_matches(self):
+        rows = [_row(i) for i in range(3)]
+        _, body = self._get(rows)
+        encode = backend._encode
+        backend._encode = json.JSONEncoder(separators=(',', ':')).encode
+        try:
+            _, fallback = self._get(rows)
+        finally:
+            backend._encode = encode
+        self.assertEqual(json.loads(fallback), json.loads(body))
+
+    def _assert_stream_slots_free(self):
+        slots = [backend._stream_slots.acquire(blocking=False) for _ in range(backend._MAX_STREAMS)]
+        for _ in filter(None, slots):
+            backend._stream_slots.release()
+        self.assertTrue(all(slots))
+
+    def test_query_error_is_503(self):
+        backend._pool = pool = _Pool(RuntimeError('relation "incidents" does not exist'))
+        response = self.client.get('/api/incidents?year=2022')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(pool.checked_out, 0)
+        self.assertEqual(pool.closed, 0)
+        self._assert_stream_slots_free()
+
+    def test_broken_connection_is_discarded(self):
+        for _ in range(backend._MAX_STREAMS + 1):
+            backend._pool = pool = _Pool(psycopg2.OperationalError('server closed the connection'),
+                                         broken=True)
+            response = self.client.get('/api/incidents?year=2022')
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual((pool.checked_out, pool.closed), (0, 1))
+        self._assert_stream_slots_free()
+
+    def test_small_result_releases_connection_before_sending(self):
+        self.assertEqual(self._checked_out_before_body([_row(i) for i in range(10)]), 0)
+
+    def test_large_result_streams(self):
+        self.assertEqual(self._checked_out_before_body([_row(i) for i in range(2500)]), 1)
+
+    def test_streams_are_capped(self):
+        rows = [_row(i) for i in range(2500)]
+        for _ in range(backend._MAX_STREAMS):
+            self.assertTrue(backend._stream_slots.acquire(timeout=1))
+        try:
+            self.assertEqual(self._checked_out_before_body(rows), 0)
+        finally:
+            for _ in range(backend._MAX_STREAMS):
+                backend._stream_slots.release()
+
+    def test_year_required(self):
+        response = self.client.get('/api/incidents')
+        self.assertEqual(response.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
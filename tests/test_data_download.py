@@ -0,0 +1,268 @@
+import contextlib
+import io
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import unittest
+import zipfile
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from scripts import data_download
+
+
+def _make_zip(seed, size=200_000):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('ACCIDENT.CSV', random.Random(seed).randbytes(size))
+    return buf.getvalue()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Serves Server.files with ETag, Range and If-Range support.
+
+    Paths in Server.no_etag are sent without an ETag; paths in
+    Server.bad_range answer every Range request from byte 0.
+    """
+
+    def do_HEAD(self):
+        self._respond(body=False)
+
+    def do_GET(self):
+        self._respond(body=True)
+
+    def _respond(self, body):
+        server = self.server
+        server.requests.append((self.command, self.path, self.headers.get('Range'),
+                                self.headers.get('If-Range')))
+        data = server.files.get(self.path)
+        if data is None:
+            self.send_error(404)
+            return
+        etag = f'"{zlib.crc32(data):08x}"'
+        start = None
+        if self.headers.get('Range') and self.headers.get('If-Range') in (None, etag):
+            start = int(self.headers['Range'][len('bytes='):].split('-')[0])
+        if start is not None and start >= len(data):
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{len(data)}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if start is not None:
+            if self.path in server.bad_range:
+                start = 0
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(data) - 1}/{len(data)}')
+        else:
+            start = 0
+            self.send_response(200)
+        if self.path not in server.no_etag:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(data) - start))
+        self.end_headers()
+        if body:
+            self.wfile.write(data[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+class DownloadTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base = f'http://127.0.0.1:{cls.server.server_port}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.files = {'/a.zip': _make_zip(1)}
+        self.server.no_etag = set()
+        self.server.bad_range = set()
+        self.server.requests = []
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+
+        # No throttling, console output or error log file during tests
+        limiter = data_download.LIMITER
+        data_download.LIMITER = data_download.RateLimiter(1000)
+        self.addCleanup(setattr, data_download, 'LIMITER', limiter)
+        handler = logging.NullHandler()
+        data_download.error_log.addHandler(handler)
+        self.addCleanup(data_download.error_log.removeHandler, handler)
+        stdout = contextlib.redirect_stdout(io.StringIO())
+        stdout.__enter__()
+        self.addCleanup(stdout.__exit__, None, None, None)
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def read(self, name):
+        with open(self.path(name), 'rb') as f:
+            return f.read()
+
+    def write(self, name, data):
+        with open(self.path(name), 'wb' if isinstance(data, bytes) else 'w') as f:
+            f.write(data)
+
+    def etag(self, url_path):
+        return f'"{zlib.crc32(self.server.files[url_path]):08x}"'
+
+    def gets(self):
+        return [r[1:] for r in self.server.requests if r[0] == 'GET']
+
+    def download(self, name='a.zip', **kwargs):
+        return data_download.download_file(f'{self.base}/{name}', self.dir, **kwargs)
+
+
+class DownloadFileTest(DownloadTestCase):
+    def test_fresh_download(self):
+        self.assertEqual(self.download(), self.path('a.zip'))
+        self.assertEqual(self.read('a.zip'), self.server.files['/a.zip'])
+        self.assertEqual(self.read('a.zip.etag').decode(), self.etag('/a.zip'))
+        self.assertEqual(sorted(os.listdir(self.dir)), ['a.zip', 'a.zip.etag'])
+
+    def test_resume_sends_range_and_if_range(self):
+        data = self.server.files['/a.zip']
+        self.write('a.zip.part', data[:50_000])
+        self.write('a.zip.part.etag', self.etag('/a.zip'))
+        self.download()
+        self.assertEqual(self.gets(), [('/a.zip', 'bytes=50000-', self.etag('/a.zip'))])
+        self.assertEqual(self.read('a.zip'), data)
+        self.assertFalse(os.path.exists(self.path('a.zip.part.etag')))
+
+    def test_changed_upstream_sends_whole_file(self):
+        self.write('a.zip.part', b'old version' * 1000)
+        self.write('a.zip.part.etag', '"stale"')
+        self.download()
+        self.assertEqual(self.gets(), [('/a.zip', 'bytes=11000-', '"stale"')])
+        self.assertEqual(self.read('a.zip'), self.server.files['/a.zip'])
+
+    def test_mismatched_206_restarts(self):
+        self.server.bad_range.add('/a.zip')
+        self.write('a.zip.part', self.server.files['/a.zip'][:50_000])
+        self.download()
+        self.assertEqual(self.gets(), [('/a.zip', 'bytes=50000-', None), ('/a.zip', None, None)])
+        self.assertEqual(self.read('a.zip'), self.server.files['/a.zip'])
+
+    def test_416_restarts(self):
+        self.write('a.zip.part', self.server.files['/a.zip'] + b'extra')
+        self.download()
+        self.assertEqual(len(self.gets()), 2)
+        self.assertEqual(self.gets()[1], ('/a.zip', None, None))
+        self.assertEqual(self.read('a.zip'), self.server.files['/a.zip'])
+
+    def test_response_without_etag_clears_stale_sidecar(self):
+        self.server.no_etag.add('/a.zip')
+        self.server.bad_range.add('/a.zip')
+        self.write('a.zip.part', b'x' * 1000)
+        self.write('a.zip.part.etag', '"from another version"')
+        # Stop once the restarted body is on disk, leaving the .part behind
+        with mock.patch.object(data_download, 'check_zip', side_effect=OSError('interrupted')):
+            with self.assertRaises(OSError):
+                self.download()
+        self.assertTrue(os.path.exists(self.path('a.zip.part')))
+        self.assertFalse(os.path.exists(self.path('a.zip.part.etag')))
+
+    def test_corrupt_zip_is_deleted_and_retried_once(self):
+        data = self.server.files['/a.zip']
+        self.server.files['/bad.zip'] = data[:-5000] + bytes(5000)
+        self.assertIsNone(self.download('bad.zip'))
+        self.assertEqual(len(self.gets()), 2)
+        self.assertEqual(os.listdir(self.dir), [])
+
+    def test_unverifiable_zip_is_kept_without_retry(self):
+        data = bytearray(self.server.files['/a.zip'])
+        data[8] = 9  # Deflate64 in the local header
+        central = data.find(b'PK\x01\x02')
+        data[central + 10] = 9  # ...and in the central directory
+        self.server.files['/d64.zip'] = bytes(data)
+        self.assertEqual(self.download('d64.zip'), self.path('d64.zip'))
+        self.assertEqual(len(self.gets()), 1)
+        self.assertEqual(self.read('d64.zip'), bytes(data))
+
+    def test_404_is_reported(self):
+        not_found = set()
+        self.assertIsNone(self.download('missing.zip', not_found=not_found))
+        self.assertEqual(not_found, {f'{self.base}/missing.zip'})
+
+
+class IsCurrentTest(DownloadTestCase):
+    def setUp(self):
+        super().setUp()
+        self.url = f'{self.base}/a.zip'
+        self.write('a.zip', self.server.files['/a.zip'])
+
+    def test_matching_size_and_etag(self):
+        self.write('a.zip.etag', self.etag('/a.zip'))
+        self.assertTrue(data_download.is_current(self.url, self.path('a.zip')))
+
+    def test_changed_etag(self):
+        self.write('a.zip.etag', '"older"')
+        self.assertFalse(data_download.is_current(self.url, self.path('a.zip')))
+
+    def test_truncated_file(self):
+        self.write('a.zip', self.server.files['/a.zip'][:-1])
+        self.write('a.zip.etag', self.etag('/a.zip'))
+        self.assertFalse(data_download.is_current(self.url, self.path('a.zip')))
+
+    def test_adopts_etag_when_none_saved(self):
+        self.assertTrue(data_download.is_current(self.url, self.path('a.zip')))
+        self.assertEqual(self.read('a.zip.etag').decode(), self.etag('/a.zip'))
+
+
+class KnownMissingTest(DownloadTestCase):
+    def setUp(self):
+        super().setUp()
+        url_tmpl = data_download.URL_TMPL
+        data_download.URL_TMPL = self.base + '/{year}/{rpart}/' + data_download.FILE_TMPL
+        self.addCleanup(setattr, data_download, 'URL_TMPL', url_tmpl)
+        self.server.files = {'/2020/National/FARS2020NationalCSV.zip': _make_zip(2, 1000)}
+
+    def run_download(self, **kwargs):
+        data_download.download_fars_data(
+            [2020], self.dir, regions=(('National', 0),), file_types=(('', 0),), **kwargs,
+        )
+
+    def known_missing(self):
+        with open(self.path(data_download.KNOWN_MISSING_FILE)) as f:
+            return json.load(f)
+
+    def test_404s_are_remembered_and_skipped(self):
+        sas_url = f'{self.base}/2020/National/FARS2020NationalSAS.zip'
+        self.run_download()
+        self.assertEqual(self.known_missing(), [sas_url])
+
+        self.server.requests = []
+        self.run_download()
+        self.assertNotIn('/2020/National/FARS2020NationalSAS.zip',
+                         [r[1] for r in self.server.requests])
+
+        # Once it appears upstream, a recheck downloads it and forgets the 404
+        self.server.files['/2020/National/FARS2020NationalSAS.zip'] = _make_zip(3, 1000)
+        self.run_download(skip_known_missing=False)
+        self.assertEqual(self.known_missing(), [])
+
+    def test_404s_do_not_leak_between_runs(self):
+        self.run_download()
+        other = os.path.join(self.dir, 'other')
+        self.server.files['/2020/National/FARS2020NationalSAS.zip'] = _make_zip(3, 1000)
+        data_download.download_fars_data(
+            [2020], other, regions=(('National', 0),), file_types=(('', 0),),
+        )
+        self.assertFalse(os.path.exists(os.path.join(other, data_download.KNOWN_MISSING_FILE)))
+
+
+if __name__ == '__main__':
+    unittest.main()
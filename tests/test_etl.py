@@ -0,0 +1,204 @@
+import contextlib
+import io
+import tempfile
+import time
+import unittest
+import zipfile
+from pathlib import Path
+from unittest import mock
+
+from src.data_processing import etl
+from src.data_processing.etl import (
+    PEDESTRIAN, PER_COLUMNS, _accident_fields, _CopyWriter, _read_csv_from_zip, process_year,
+)
+
+
+def _zip(text: str) -> zipfile.ZipFile:
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as zf:
+        zf.writestr('person.csv', text)
+    return zipfile.ZipFile(buf)
+
+
+class ReadCsvFromZipTest(unittest.TestCase):
+    def test_projects_columns_case_insensitively(self):
+        zf = _zip('ST_CASE,PER_TYP,AGE,SEX,INJ_SEV\r\n10001,5,34,1,4\r\n')
+        rows = list(_read_csv_from_zip(zf, 'person.csv', PER_COLUMNS))
+        self.assertEqual(rows, [('10001', '34', '1', '4')])
+
+    def test_missing_column_reads_as_empty(self):
+        zf = _zip('ST_CASE,AGE,SEX\r\n10001,34,1\r\n')
+        rows = list(_read_csv_from_zip(zf, 'person.csv', PER_COLUMNS))
+        self.assertEqual(rows, [('10001', '34', '1', '')])
+
+    def test_blank_lines_are_skipped(self):
+        zf = _zip('ST_CASE,PER_TYP,AGE,SEX,INJ_SEV\r\n\r\n10001,5,34,1,4\r\n\r\n')
+        rows = list(_read_csv_from_zip(zf, 'person.csv', PER_COLUMNS, where=PEDESTRIAN))
+        self.assertEqual(rows, [('10001', '34', '1', '4')])
+
+    def test_short_rows_are_padded(self):
+        zf = _zip('ST_CASE,PER_TYP,AGE,SEX,INJ_SEV\r\n10001,5,34\r\n10002\r\n10003,5\r\n')
+        rows = list(_read_csv_from_zip(zf, 'person.csv', PER_COLUMNS, where=PEDESTRIAN))
+        self.assertEqual(rows, [('10001', '34', '', ''), ('10003', '', '', '')])
+
+    def test_where_filters_rows(self):
+        zf = _zip('ST_CASE,PER_TYP,AGE,SEX,INJ_SEV\r\n10001,1,34,1,4\r\n10002, 5 ,7,2,3\r\n')
+        rows = list(_read_csv_from_zip(zf, 'person.csv', PER_COLUMNS, where=PEDESTRIAN))
+        self.assertEqual(rows, [('10002', '7', '2', '3')])
+
+    def test_where_on_absent_column_yields_nothing(self):
+        zf = _zip('ST_CASE,AGE,SEX,INJ_SEV\r\n10001,34,1,4\r\n')
+        rows = list(_read_csv_from_zip(zf, 'person.csv', PER_COLUMNS, where=PEDESTRIAN))
+        self.assertEqual(rows, [])
+
+
+
+def _acc(lat, lon):
+    return ('10001', lat, lon, '1', '2', '18', '48', '2', '1', '5', '', '1', '73')
+
+
+class AccidentFieldsTest(unittest.TestCase):
+    def test_ewkt_and_codes(self):
+        self.assertEqual(
+            _accident_fields(_acc('33.54', '-86.69'), 2022),
+            ('SRID=4326;POINT(-86.69 33.54)', 2022, 1, 2, 18, 48, 2, 1, 5, None, 1, 73),
+        )
+
+    def test_missing_coordinates_are_rejected(self):
+        self.assertIsNone(_accident_fields(_acc('', '-86.69'), 2022))
+        self.assertIsNone(_accident_fields(_acc('33.54', 'n/a'), 2022))
+
+    def test_sentinels_and_out_of_bounds_are_rejected(self):
+        for lat, lon in [('0', '0'), ('77.7777', '777.7777'), ('88.8888', '888.8888'),
+                         ('99.9999', '999.9999'), ('nan', 'nan'), ('51.5', '-0.12'),
+                         ('10', '-86.69'), ('33.54', '-200')]:
+            with self.subTest(lat=lat, lon=lon):
+                self.assertIsNone(_accident_fields(_acc(lat, lon), 2022))
+
+    def test_territories_are_kept(self):
+        self.assertIsNotNone(_accident_fields(_acc('18.4', '-66.1'), 2022))  # Puerto Rico
+        self.assertIsNotNone(_accident_fields(_acc('61.2', '-149.9'), 2022))  # Alaska
+
+
+class _Cursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def copy_expert(self, sql, f):
+        if self.conn.fail:
+            raise RuntimeError('COPY failed')
+        self.conn.copied.append(f.read())
+
+
+class _Conn:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.copied = []
+        self.commits = 0
+
+    def cursor(self):
+        return _Cursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+
+class CopyWriterTest(unittest.TestCase):
+    def test_batches_are_copied_in_order(self):
+        conn = _Conn()
+        writer = _CopyWriter(conn)
+        writer.put([('a', 1)])
+        writer.put([])
+        writer.put([('b', None)])
+        writer.close()
+        self.assertEqual(conn.copied, ['a,1\n', 'b,\n'])
+
+    def test_copy_error_is_raised_on_close(self):
+        writer = _CopyWriter(_Conn(fail=True))
+        writer.put([('a', 1)])
+        with self.assertRaisesRegex(RuntimeError, 'COPY failed'):
+            writer.close()
+
+    def test_put_after_error_raises(self):
+        writer = _CopyWriter(_Conn(fail=True))
+        writer.put([('a', 1)])
+        # The failure surfaces on whichever put() follows the worker hitting it
+        deadline = time.monotonic() + 5
+        with self.assertRaisesRegex(RuntimeError, 'COPY failed'):
+            while time.monotonic() < deadline:
+                writer.put([('b', 2)])
+                time.sleep(0.01)
+        with self.assertRaises(RuntimeError):
+            writer.close()
+
+
+ACCIDENT_CSV = (
+    'ST_CASE,LATITUDE,LONGITUD,MONTH,DAY,HOUR,MINUTE,LGT_COND,WEATHER,ROUTE,RUR_URB,STATE,COUNTY\r\n'
+    '1,33.54,-86.69,1,2,18,48,2,1,5,2,1,73\r\n'
+    '2,99.9999,999.9999,3,4,5,6,1,1,1,1,1,1\r\n'
+)
+PERSON_CSV = (
+    'ST_CASE,PER_TYP,AGE,SEX,INJ_SEV\r\n'
+    '1,1,40,1,0\r\n'   # driver, not a pedestrian
+    '1,5,27,1,4\r\n'
+    '1,5,9,2,3\r\n'
+    '2,5,60,2,4\r\n'   # crash without usable coordinates
+    '3,5,33,1,4\r\n'   # no matching crash
+)
+
+
+class ProcessYearTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.data_dir = Path(tmp.name)
+        (self.data_dir / '2022').mkdir()
+        with zipfile.ZipFile(self.data_dir / '2022' / 'FARS2022NationalCSV.zip', 'w') as zf:
+            zf.writestr('FARS2022NationalCSV/ACCIDENT.CSV', ACCIDENT_CSV)
+            zf.writestr('FARS2022NationalCSV/PERSON.CSV', PERSON_CSV)
+
+    def _process(self, conn, **kwargs):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return process_year(2022, self.data_dir, conn, **kwargs)
+
+    def test_loads_pedestrians(self):
+        conn = _Conn()
+        self.assertEqual(self._process(conn), 2)
+        self.assertEqual(''.join(conn.copied), (
+            'SRID=4326;POINT(-86.69 33.54),2022,1,2,18,48,2,1,5,2,1,73,27,1,4\n'
+            'SRID=4326;POINT(-86.69 33.54),2022,1,2,18,48,2,1,5,2,1,73,9,2,3\n'
+        ))
+        self.assertEqual(conn.commits, 1)
+
+    def test_crash_fields_are_converted_once_per_crash(self):
+        with mock.patch.object(etl, '_accident_fields', wraps=_accident_fields) as fields:
+            self._process(_Conn())
+        self.assertEqual(sorted(c.args[0][0] for c in fields.call_args_list), ['1', '2'])
+
+    def test_commit_can_be_left_to_the_caller(self):
+        conn = _Conn()
+        self._process(conn, commit=False)
+        self.assertEqual(conn.commits, 0)
+
+    def test_copy_error_propagates_without_commit(self):
+        conn = _Conn(fail=True)
+        with mock.patch.object(etl, 'COPY_BATCH_SIZE', 1):
+            with self.assertRaisesRegex(RuntimeError, 'COPY failed'):
+                self._process(conn)
+        self.assertEqual(conn.commits, 0)
+
+    def test_missing_zip_loads_nothing(self):
+        conn = _Conn()
+        with contextlib.redirect_stderr(io.StringIO()):
+            self.assertEqual(process_year(1999, self.data_dir, conn), 0)
+        self.assertEqual(conn.copied, [])
+
+
+if __name__ == '__main__':
+    unittest.main()